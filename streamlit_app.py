@@ -1,10 +1,17 @@
 import streamlit as st
 import os
+import httpx
+import re
 import json
 import time
-import pandas as pd
+import random
+import queue
+import asyncio
+import threading
 from dotenv import load_dotenv
 from google import genai
+from google.genai import types
+from pydantic import BaseModel
 import pyarabic.araby as araby
 
 # ── Page config ───────────────────────────────────────────────────────────────
@@ -33,9 +40,30 @@ def load_gemini_client():
     if not api_key:
         st.error("GEMINI_API_KEY not found.")
         st.stop()
-    return genai.Client(api_key=api_key)
+    # Keep connections alive between calls so later sentences skip the TLS handshake.
+    # The async client is passed explicitly so the SDK stays on httpx (not aiohttp).
+    limits = httpx.Limits(max_keepalive_connections=20, max_connections=40)
+    return genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(
+            timeout=30_000,
+            client_args={"limits": limits},
+            httpx_async_client=httpx.AsyncClient(limits=limits),
+        )
+    )
 
 # ── PyArabic Preprocessing ────────────────────────────────────────────────────
+# Built once at import: str.translate does each normalization in a single C pass
+TASHKEEL_TBL = str.maketrans("", "", "".join(araby.TASHKEEL))
+HAMZA_TBL    = str.maketrans({
+    araby.ALEF_HAMZA_ABOVE: araby.ALEF,
+    araby.ALEF_HAMZA_BELOW: araby.ALEF,
+    araby.ALEF_MADDA      : araby.ALEF,
+    araby.ALEF_WASLA      : araby.ALEF,
+    # Lam-alef ligatures → two letters (same as araby.normalize_ligature)
+    **{lig: araby.LAM + araby.ALEF for lig in araby.LIGUATURES},
+})
+
 def preprocess_arabic(sentence):
     """
     Extract rich linguistic features from Arabic text using PyArabic.
@@ -46,13 +74,13 @@ def preprocess_arabic(sentence):
 
     for token in tokens:
         # Strip diacritics for base form
-        stripped     = araby.strip_tashkeel(token)
+        stripped     = token.translate(TASHKEEL_TBL)
         # Remove only last haraka (useful for case detection)
         no_last      = araby.strip_lastharaka(token)
-        # Normalize letter variants (alef, hamza, etc.)
-        normalized   = araby.normalize_ligature(araby.normalize_hamza(stripped))
+        # Normalize letter variants (alef forms, lam-alef ligatures)
+        normalized   = stripped.translate(HAMZA_TBL)
         # Detect definite article
-        has_al       = araby.has_alef_lam(stripped) if hasattr(araby, 'has_alef_lam') else stripped.startswith(araby.ALEF + araby.LAM)
+        has_al       = stripped[:2] == araby.ALEF + araby.LAM
         # Sun/moon letter detection for words with ال
         is_sun       = False
         if has_al and len(stripped) > 2:
@@ -76,20 +104,20 @@ def format_features_for_prompt(word_features):
     """
     Format PyArabic features into a readable string for the Gemini prompt.
     """
-    lines = []
-    for f in word_features:
-        al_info = ""
-        if f["has_al"]:
-            al_info = " | has ال (definite)" + (" + sun letter assimilation" if f["is_sun"] else " + moon letter")
-        lines.append(
-            "- " + f["token"] +
-            " | base: "       + f["stripped"] +
-            " | normalized: " + f["normalized"] +
-            al_info
-        )
-    return "\n".join(lines)
+    return "\n".join(
+        f"- {f['token']} | base: {f['stripped']} | normalized: {f['normalized']}{al_info(f)}"
+        for f in word_features
+    )
+
+def al_info(f):
+    if not f["has_al"]:
+        return ""
+    return " | has ال (definite)" + (" + sun letter assimilation" if f["is_sun"] else " + moon letter")
 
 # ── Prompt ────────────────────────────────────────────────────────────────────
+# Fastest first — irab is short-context, short-output JSON, so latency dominates
+MODELS = ["gemini-2.0-flash-lite", "gemini-2.0-flash", "gemini-2.5-flash"]
+
 SYSTEM_PROMPT = """أنت خبير في النحو العربي والإعراب.
 You are an expert in Arabic grammar and irab (grammatical analysis).
 
@@ -103,94 +131,395 @@ For each word provide:
 3. التفاصيل  — details (definiteness, gender, number, verb tense, etc.)
 4. explanation — one clear sentence in English
 
-Return ONLY a valid JSON array, no markdown, no text outside the array."""
+Return ONLY a valid JSON array, no markdown, no text outside the array.
+
+Reference examples — follow their level of detail and wording. Do not analyze
+these sentences; analyze only the sentence you are given.
+
+Sentence: إن العلمَ نورٌ
+[{"word":"إن","irab":"حرف توكيد ونصب","sign":"مبني على الفتح لا محل له من الإعراب","details":"من أخوات إن، ينصب المبتدأ ويرفع الخبر","explanation":"An emphatic particle that puts its noun in the accusative and its predicate in the nominative."},
+ {"word":"العلم","irab":"اسم إن","sign":"منصوب وعلامة نصبه الفتحة الظاهرة على آخره","details":"اسم معرف بأل، مذكر، مفرد","explanation":"The noun of inna, so it takes the accusative fatha."},
+ {"word":"نور","irab":"خبر إن","sign":"مرفوع وعلامة رفعه تنوين الضم الظاهر على آخره","details":"اسم نكرة، مذكر، مفرد","explanation":"The predicate of inna, which stays in the nominative."}]
+
+Sentence: كان الجوُّ باردًا
+[{"word":"كان","irab":"فعل ماض ناقص","sign":"مبني على الفتح","details":"من أخوات كان، يرفع المبتدأ وينصب الخبر","explanation":"A defective past verb that turns the subject into its noun and the predicate into its accusative complement."},
+ {"word":"الجو","irab":"اسم كان","sign":"مرفوع وعلامة رفعه الضمة الظاهرة على آخره","details":"اسم معرف بأل، مذكر، مفرد","explanation":"The noun of kana, which is nominative."},
+ {"word":"باردا","irab":"خبر كان","sign":"منصوب وعلامة نصبه تنوين الفتح الظاهر على آخره","details":"اسم نكرة، مذكر، مفرد","explanation":"The predicate of kana, which is accusative."}]
+
+Sentence: الطالبُ مجتهدٌ
+[{"word":"الطالب","irab":"مبتدأ","sign":"مرفوع وعلامة رفعه الضمة الظاهرة على آخره","details":"اسم معرف بأل، مذكر، مفرد","explanation":"The subject of a nominal sentence is nominative."},
+ {"word":"مجتهد","irab":"خبر","sign":"مرفوع وعلامة رفعه تنوين الضم الظاهر على آخره","details":"اسم نكرة، مذكر، مفرد","explanation":"The predicate of the subject, also nominative."}]
+
+Sentence: رأيتُ الطفلَ مبتسمًا
+[{"word":"رأيت","irab":"فعل ماض وفاعله","sign":"مبني على السكون لاتصاله بتاء الفاعل، والتاء ضمير متصل مبني على الضم في محل رفع فاعل","details":"فعل ماض متعد، مبني للمعلوم، الفاعل ضمير المتكلم","explanation":"A past verb with the attached pronoun tu as its subject."},
+ {"word":"الطفل","irab":"مفعول به","sign":"منصوب وعلامة نصبه الفتحة الظاهرة على آخره","details":"اسم معرف بأل، مذكر، مفرد","explanation":"The direct object of the verb, so it is accusative."},
+ {"word":"مبتسما","irab":"حال","sign":"منصوب وعلامة نصبه تنوين الفتح الظاهر على آخره","details":"اسم فاعل نكرة، مذكر، مفرد، صاحب الحال: الطفل","explanation":"A circumstantial word describing the child's state, which is accusative."}]
+
+Sentence: قرأ محمدٌ كتابَ التاريخِ الجديدَ
+[{"word":"قرأ","irab":"فعل ماض","sign":"مبني على الفتح","details":"فعل ماض ثلاثي متعد، مبني للمعلوم","explanation":"A past tense verb, built on fatha."},
+ {"word":"محمد","irab":"فاعل","sign":"مرفوع وعلامة رفعه تنوين الضم الظاهر على آخره","details":"اسم علم، مذكر، مفرد","explanation":"The doer of the action, so it is nominative."},
+ {"word":"كتاب","irab":"مفعول به","sign":"منصوب وعلامة نصبه الفتحة الظاهرة على آخره، وهو مضاف","details":"اسم معرف بالإضافة، مذكر، مفرد","explanation":"The direct object, defined by being the first term of an idafa."},
+ {"word":"التاريخ","irab":"مضاف إليه","sign":"مجرور وعلامة جره الكسرة الظاهرة على آخره","details":"اسم معرف بأل، مذكر، مفرد","explanation":"The second term of the idafa, which is always genitive."},
+ {"word":"الجديد","irab":"نعت","sign":"منصوب وعلامة نصبه الفتحة الظاهرة على آخره","details":"نعت لكتاب يتبعه في النصب والتعريف والتذكير والإفراد","explanation":"An adjective agreeing with the book, so it follows it in the accusative."}]
+
+Sentence: جلس المعلمون أمامَ الطلابِ صباحًا
+[{"word":"جلس","irab":"فعل ماض","sign":"مبني على الفتح","details":"فعل ماض ثلاثي لازم، مبني للمعلوم","explanation":"An intransitive past tense verb."},
+ {"word":"المعلمون","irab":"فاعل","sign":"مرفوع وعلامة رفعه الواو لأنه جمع مذكر سالم","details":"اسم معرف بأل، مذكر، جمع مذكر سالم","explanation":"The subject; sound masculine plurals show the nominative with waw."},
+ {"word":"أمام","irab":"ظرف مكان","sign":"منصوب وعلامة نصبه الفتحة الظاهرة على آخره، وهو مضاف","details":"ظرف مكان متعلق بالفعل جلس","explanation":"An adverb of place telling where they sat."},
+ {"word":"الطلاب","irab":"مضاف إليه","sign":"مجرور وعلامة جره الكسرة الظاهرة على آخره","details":"اسم معرف بأل، مذكر، جمع تكسير","explanation":"Completes the adverb of place as the second term of an idafa."},
+ {"word":"صباحا","irab":"ظرف زمان","sign":"منصوب وعلامة نصبه تنوين الفتح الظاهر على آخره","details":"ظرف زمان نكرة متعلق بالفعل جلس","explanation":"An adverb of time telling when they sat."}]
+
+Sentence: لم يحضرْ أخوك الدرسَ
+[{"word":"لم","irab":"حرف نفي وجزم وقلب","sign":"مبني على السكون لا محل له من الإعراب","details":"يجزم الفعل المضارع ويقلب زمنه إلى الماضي","explanation":"A particle that negates and puts the present verb in the jussive with past meaning."},
+ {"word":"يحضر","irab":"فعل مضارع","sign":"مجزوم بلم وعلامة جزمه السكون الظاهر على آخره","details":"فعل مضارع متعد، مبني للمعلوم","explanation":"A present tense verb in the jussive because of lam."},
+ {"word":"أخوك","irab":"فاعل","sign":"مرفوع وعلامة رفعه الواو لأنه من الأسماء الخمسة، وهو مضاف، والكاف ضمير متصل مبني على الفتح في محل جر مضاف إليه","details":"من الأسماء الخمسة، مذكر، مفرد، معرف بالإضافة إلى الضمير","explanation":"The subject; one of the five nouns, which show the nominative with waw."},
+ {"word":"الدرس","irab":"مفعول به","sign":"منصوب وعلامة نصبه الفتحة الظاهرة على آخره","details":"اسم معرف بأل، مذكر، مفرد","explanation":"The direct object of the verb, so it is accusative."}]"""
+
+class IrabItem(BaseModel):
+    word       : str
+    irab       : str
+    sign       : str
+    details    : str
+    explanation: str
+
+# Constrained decoding: Gemini emits bare JSON matching the schema (no fences, no prose)
+JSON_OUTPUT = {
+    "response_mime_type": "application/json",
+    "response_schema"   : list[IrabItem],
+}
 
 def create_prompt(sentence, word_features):
     features_str = format_features_for_prompt(word_features)
     return (
-        SYSTEM_PROMPT
-        + "\n\nSentence: " + sentence
+        "Sentence: " + sentence
         + "\n\nPyArabic linguistic features:\n" + features_str
-        + "\n\nReturn ONLY a JSON array:\n"
-        + "[{\"word\":\"...\",\"irab\":\"...\",\"sign\":\"...\",\"details\":\"...\",\"explanation\":\"...\"}]"
     )
 
 # ── Analysis ──────────────────────────────────────────────────────────────────
-def get_irab(sentence, word_features, client):
-    prompt = create_prompt(sentence, word_features)
-    for attempt in range(3):
+# Smallest prompt Gemini accepts for explicit context caching, per model.
+# Only 2.5-flash is listed: flash-lite doesn't support explicit caching, and
+# 2.0-flash's 4096-token minimum is above the size of SYSTEM_PROMPT.
+CACHE_MIN_TOKENS = {
+    "gemini-2.5-flash": 1024,
+}
+
+@st.cache_resource(ttl=3000)
+def get_system_cache(_client, model):
+    """
+    Upload SYSTEM_PROMPT once per model as a Gemini context cache so every
+    request only sends the per-sentence tail. Returns None when the model
+    can't cache it (unsupported, prompt under the minimum size, quota); that
+    result is memoized too, so a failing model isn't retried on every request.
+    Refreshed before the server-side TTL runs out.
+    """
+    min_tokens = CACHE_MIN_TOKENS.get(model)
+    if min_tokens is None:
+        return None
+    try:
+        count = _client.models.count_tokens(model=model, contents=SYSTEM_PROMPT)
+        if count.total_tokens < min_tokens:
+            return None
+        return _client.caches.create(
+            model=model,
+            config={"system_instruction": SYSTEM_PROMPT, "ttl": "3600s"}
+        )
+    except Exception:
+        return None
+
+def get_generation_config(client, model):
+    """
+    Point the request at the cached system prompt, or send it inline when the
+    model has no cache. The reference examples go out either way, so answer
+    quality doesn't depend on which model can cache.
+    """
+    cache = get_system_cache(client, model)
+    if cache is None:
+        return {**JSON_OUTPUT, "system_instruction": SYSTEM_PROMPT}
+    return {**JSON_OUTPUT, "cached_content": cache.name}
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `capacity` requests may burst at once, then
+    tokens refill at `rate` per second. Shared by every session in the process.
+    """
+    def __init__(self, rate, capacity):
+        self.rate     = rate
+        self.capacity = capacity
+        self._tokens  = capacity
+        self._updated = time.monotonic()
+        self._lock    = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return how many seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens  = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+@st.cache_resource
+def get_rate_limiter():
+    # Gemini free tier: 15 requests per minute
+    return TokenBucket(rate=15 / 60, capacity=15)
+
+class JsonArrayStream:
+    """
+    Incrementally parse a streamed JSON array, handing back each element as
+    soon as it is complete. Anything before the opening "[" (e.g. a ```json
+    fence) is skipped.
+    """
+    _decoder = json.JSONDecoder()
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos    = None   # next unparsed index inside the array
+        self.done   = False
+
+    def feed(self, text):
+        self.buffer += text
+        items = []
+        if self.pos is None:
+            start = self.buffer.find("[")
+            if start == -1:
+                return items
+            self.pos = start + 1
+        while not self.done:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n,":
+                self.pos += 1
+            if self.pos >= len(self.buffer):
+                break
+            if self.buffer[self.pos] == "]":
+                self.done = True
+                break
+            try:
+                item, self.pos = self._decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                break   # element not fully streamed yet
+            items.append(item)
+        return items
+
+    def close(self):
+        if not self.done:
+            raise json.JSONDecodeError("Unterminated JSON array", self.buffer, self.pos or 0)
+
+async def get_irab(prompt, client, model, config, semaphore, limiter, on_progress):
+    """
+    Stream the irab for one sentence's prompt, calling on_progress(words) with
+    every word parsed so far as soon as a new one is complete.
+    """
+    async with semaphore:
+        for attempt in range(3):
+            try:
+                await asyncio.sleep(limiter.reserve())
+                stream = JsonArrayStream()
+                words  = []
+                async for chunk in await client.aio.models.generate_content_stream(
+                    model=model,
+                    contents=prompt,
+                    config=config
+                ):
+                    new_words = stream.feed(chunk.text or "")
+                    if new_words:
+                        words.extend(new_words)
+                        on_progress(words)
+                stream.close()
+                return {"success": True, "data": words}
+            except json.JSONDecodeError:
+                return {"success": False, "error": "Could not parse Gemini response. Try again."}
+            except Exception as e:
+                err = str(e)
+                if "CachedContent" in err or "cached content" in err.lower():
+                    # Cache expired server-side — retry inline; next analysis recreates it
+                    get_system_cache.clear()
+                    config = {**JSON_OUTPUT, "system_instruction": SYSTEM_PROMPT}
+                elif "429" in err:
+                    if "PerDay" in err:
+                        return {"success": False, "error": "Daily quota reached. Try again tomorrow."}
+                    # Per-minute limit — exponential backoff with jitter, unless
+                    # this was the last attempt and there is nothing left to wait for
+                    if attempt < 2:
+                        await asyncio.sleep(min(30 * 2 ** attempt, 600) + random.uniform(0, 5))
+                else:
+                    return {"success": False, "error": err}
+        return {"success": False, "error": "Max retries exceeded."}
+
+# ── Multi-sentence input ──────────────────────────────────────────────────────
+MAX_CONCURRENT_REQUESTS = 5
+# A terminator only ends a sentence when whitespace follows, so "3.5" stays whole
+_SENTENCE_RE = re.compile(r"(?<=[.!?؟])\s+")
+
+def split_sentences(text):
+    """
+    Split pasted text into sentences on . ! ? ؟ followed by whitespace or the
+    end of the text (kept with their sentence).
+    """
+    return [s.strip() for s in _SENTENCE_RE.split(text) if s.strip(" \t\n.!?؟")]
+
+@st.cache_resource
+def get_event_loop():
+    """
+    One long-lived event loop in a background thread, so Gemini's async client
+    keeps its connection pool on a loop that outlives each analysis.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+async def get_irab_all(prompts, client, model, config, limiter, on_progress):
+    """
+    Run get_irab for every sentence's prompt concurrently, at most
+    MAX_CONCURRENT_REQUESTS at a time. on_progress(i, words) reports partial
+    results for sentence i.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return await asyncio.gather(*[
+        get_irab(prompt, client, model, config, semaphore, limiter,
+                 lambda words, i=i: on_progress(i, words))
+        for i, prompt in enumerate(prompts)
+    ])
+
+# Lam-alef presentation forms → lam + the same alef, hamza kept
+LIGATURE_TBL = str.maketrans({
+    araby.LAM_ALEF            : araby.LAM + araby.ALEF,
+    araby.LAM_ALEF_HAMZA_ABOVE: araby.LAM + araby.ALEF_HAMZA_ABOVE,
+    araby.LAM_ALEF_HAMZA_BELOW: araby.LAM + araby.ALEF_HAMZA_BELOW,
+    araby.LAM_ALEF_MADDA_ABOVE: araby.LAM + araby.ALEF_MADDA,
+})
+
+def normalize_for_cache(sentence):
+    """
+    Collapse encoding-only variants of a sentence (spacing, lam-alef ligatures)
+    into one cache key. Diacritics and hamza forms are kept: both change the
+    reading (إنْ vs أنْ), so each spelling gets its own analysis.
+    """
+    return " ".join(sentence.translate(LIGATURE_TBL).split())
+
+class _CacheMiss(Exception):
+    """Raised by _stored_analysis on a lookup miss (exceptions aren't cached)."""
+
+# Bounded so a busy public deployment can't grow the in-memory cache without limit.
+# No ttl: Streamlit ignores ttl for persist="disk" caches.
+@st.cache_data(persist="disk", show_spinner=False, max_entries=1000)
+def _stored_analysis(norm_sentence, model, _analysis=None):
+    """
+    Disk-backed store of finished irab results. Called without _analysis to
+    look one up, with it to store one. It renders nothing, so a cache hit replays
+    no elements — streaming happens outside, in run_full_analysis.
+    """
+    if _analysis is None:
+        raise _CacheMiss
+    return _analysis
+
+def stream_irab(prompts, model):
+    """
+    Run every prompt through Gemini, rendering word cards into a temporary
+    preview as they stream in. Returns one get_irab response per prompt.
+    """
+    client  = load_gemini_client()
+    updates = queue.Queue()
+    future  = asyncio.run_coroutine_threadsafe(
+        get_irab_all(
+            prompts, client, model, get_generation_config(client, model), get_rate_limiter(),
+            lambda i, words: updates.put((i, list(words)))
+        ),
+        get_event_loop()
+    )
+    preview = st.empty()
+    partial = {}
+    while not future.done():
         try:
-            response = client.models.generate_content(
-                model="gemini-2.0-flash",
-                contents=prompt
-            )
-            text = response.text.strip()
-            if text.startswith("```json"):
-                text = text.split("```json")[1].split("```")[0].strip()
-            elif text.startswith("```"):
-                text = text.split("```")[1].split("```")[0].strip()
-            return {"success": True, "data": json.loads(text)}
-        except json.JSONDecodeError:
-            return {"success": False, "error": "Could not parse Gemini response. Try again."}
-        except Exception as e:
-            err = str(e)
-            if "429" in err:
-                if "PerDay" in err:
-                    return {"success": False, "error": "Daily quota reached. Try again tomorrow."}
-                time.sleep(60 * (attempt + 1))
-            else:
-                return {"success": False, "error": err}
-    return {"success": False, "error": "Max retries exceeded."}
-
-@st.cache_data(show_spinner=False)
-def run_full_analysis(sentence):
-    client        = load_gemini_client()
-    word_features = preprocess_arabic(sentence)
-    irab_resp     = get_irab(sentence, word_features, client)
+            i, words = updates.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        partial[i] = words
+        preview.markdown(
+            "".join(word_card(w) for idx in sorted(partial) for w in partial[idx]),
+            unsafe_allow_html=True
+        )
+    preview.empty()
+    return future.result()
+
+def run_full_analysis(sentence, model):
+    norm_sentence = normalize_for_cache(sentence)
+    # Preprocessing is cheap, so it always runs on the text exactly as typed
+    sentences     = split_sentences(sentence) or [sentence]
+    features      = [preprocess_arabic(s) for s in sentences]
+    try:
+        irab = _stored_analysis(norm_sentence, model)
+    except _CacheMiss:
+        responses = stream_irab([create_prompt(s, f) for s, f in zip(sentences, features)], model)
+        for irab_resp in responses:
+            # Failures (quota, parse errors) are returned but never stored
+            if not irab_resp["success"]:
+                return {
+                    "original"     : sentence,
+                    "word_features": [],
+                    "irab"         : [],
+                    "success"      : False,
+                    "error"        : irab_resp["error"]
+                }
+        irab = _stored_analysis(norm_sentence, model, _analysis=[
+            w for irab_resp in responses for w in irab_resp["data"]
+        ])
+    # Resolve card colors after the store so IRAB_COLORS edits apply to old entries
+    for w in irab:
+        w["_color"] = get_color(w.get("irab", ""))
     return {
-        "original"    : sentence,
-        "word_features": word_features,
-        "irab"        : irab_resp.get("data", []),
-        "success"     : irab_resp["success"],
-        "error"       : irab_resp.get("error")
+        "original"     : sentence,
+        "word_features": [f for word_features in features for f in word_features],
+        "irab"         : irab,
+        "success"      : True,
+        "error"        : None
     }
 
 # ── UI Helpers ────────────────────────────────────────────────────────────────
+IRAB_COLORS = {
+    "فاعل"      : "#2e7d32",
+    "مفعول به"  : "#1565c0",
+    "مبتدأ"     : "#e65100",
+    "خبر"       : "#ad1457",
+    "مضاف إليه" : "#6a1b9a",
+    "نعت"       : "#00838f",
+    "حال"       : "#f9a825",
+    "فعل"       : "#4e342e",
+    "حرف"       : "#546e7a",
+    "ظرف"       : "#558b2f",
+}
+_IRAB_RE = re.compile("|".join(map(re.escape, IRAB_COLORS)))
+
 def get_color(irab_type):
-    colors = {
-        "فاعل"      : "#2e7d32",
-        "مفعول به"  : "#1565c0",
-        "مبتدأ"     : "#e65100",
-        "خبر"       : "#ad1457",
-        "مضاف إليه" : "#6a1b9a",
-        "نعت"       : "#00838f",
-        "حال"       : "#f9a825",
-        "فعل"       : "#4e342e",
-        "حرف"       : "#546e7a",
-        "ظرف"       : "#558b2f",
-    }
-    for key, color in colors.items():
-        if key in irab_type:
-            return color
-    return "#37474f"
+    # Irab strings lead with the role, so the first matching term wins
+    m = _IRAB_RE.search(irab_type)
+    return IRAB_COLORS[m.group(0)] if m else "#37474f"
+
+# Gemini field → summary table column
+IRAB_COLUMNS = {
+    "word"       : "الكلمة",
+    "irab"       : "الإعراب",
+    "sign"       : "العلامة",
+    "details"    : "التفاصيل",
+    "explanation": "Explanation",
+}
 
 def word_card(word_data):
-    color       = get_color(word_data.get("irab", ""))
+    color       = word_data.get("_color") or get_color(word_data.get("irab", ""))
     word        = word_data.get("word", "")
     irab        = word_data.get("irab", "")
     sign        = word_data.get("sign", "")
     details     = word_data.get("details", "")
     explanation = word_data.get("explanation", "")
+    # Adjacent f-strings compile to one string build (no indented HTML: markdown would treat it as code)
     return (
-        "<div style=\"background:#fff;border-right:6px solid " + color + ";"
-        "border-radius:10px;padding:16px 20px;margin:10px 0;"
-        "box-shadow:0 2px 6px rgba(0,0,0,0.08);direction:rtl;\">"
-        "<div style=\"font-size:26px;font-weight:bold;color:" + color + ";margin-bottom:8px;\">" + word + "</div>"
-        "<p style=\"margin:4px 0\"><strong>الإعراب:</strong> " + irab + "</p>"
-        "<p style=\"margin:4px 0\"><strong>العلامة:</strong> " + sign + "</p>"
-        "<p style=\"margin:4px 0\"><strong>التفاصيل:</strong> " + details + "</p>"
-        "<p style=\"margin:4px 0;color:#666;font-style:italic\">" + explanation + "</p>"
-        "</div>"
+        f"<div style=\"background:#fff;border-right:6px solid {color};"
+        f"border-radius:10px;padding:16px 20px;margin:10px 0;"
+        f"box-shadow:0 2px 6px rgba(0,0,0,0.08);direction:rtl;\">"
+        f"<div style=\"font-size:26px;font-weight:bold;color:{color};margin-bottom:8px;\">{word}</div>"
+        f"<p style=\"margin:4px 0\"><strong>الإعراب:</strong> {irab}</p>"
+        f"<p style=\"margin:4px 0\"><strong>العلامة:</strong> {sign}</p>"
+        f"<p style=\"margin:4px 0\"><strong>التفاصيل:</strong> {details}</p>"
+        f"<p style=\"margin:4px 0;color:#666;font-style:italic\">{explanation}</p>"
+        f"</div>"
     )
 
 def render_sidebar():
@@ -206,9 +535,11 @@ def render_sidebar():
         **Pipeline:**
         - PyArabic → tokenization, normalization,
           definite article & sun/moon letter detection
-        - Gemini 2.0 Flash → full irab analysis
+        - Gemini → full irab analysis
         """)
         st.markdown("---")
+        model = st.selectbox("Model", MODELS, index=0, key="model")
+        st.markdown("---")
         st.markdown("### أمثلة — Try an example")
         examples = [
             "ذهب الولد إلى المدرسة",
@@ -219,14 +550,49 @@ def render_sidebar():
             "تفتح الأزهار في الربيع",
             "كان الطقس جميلاً في الصباح",
         ]
-        for ex in examples:
-            if st.button(ex, key="ex_" + ex, use_container_width=True):
-                st.session_state.input_text = ex
-                st.rerun()
+        choice = st.selectbox(
+            "Example", ["--"] + examples, key="example", label_visibility="collapsed"
+        )
+        if st.button("📥 تحميل | Load", use_container_width=True, disabled=choice == "--"):
+            st.session_state.input_text = choice
+            st.rerun()
+    return model
+
+def render_cache_debug():
+    """
+    Hidden cache usage view, shown only when the URL has ?debug=cache.
+    """
+    # Not re-exported under st.*; this is what feeds /_stcore/metrics
+    from streamlit.runtime.caching import (
+        get_data_cache_stats_provider, get_resource_cache_stats_provider
+    )
+    import pandas as pd
+
+    rows = []
+    for provider in (get_data_cache_stats_provider(), get_resource_cache_stats_provider()):
+        stats = provider.get_stats()
+        # Older Streamlit returns a flat list, newer groups stats by metric family
+        if isinstance(stats, dict):
+            stats = [stat for family in stats.values() for stat in family]
+        rows += [
+            {"Category": stat.category_name, "Cache": stat.cache_name, "Bytes": stat.byte_length}
+            for stat in stats
+        ]
+    with st.expander("🛠️ Cache stats", expanded=True):
+        if rows:
+            st.dataframe(
+                pd.DataFrame(rows).groupby(["Category", "Cache"], as_index=False).sum(),
+                use_container_width=True,
+                hide_index=True
+            )
+        else:
+            st.caption("No cached entries yet.")
 
 # ── Main ──────────────────────────────────────────────────────────────────────
 def main():
-    render_sidebar()
+    model = render_sidebar()
+    if st.query_params.get("debug") == "cache":
+        render_cache_debug()
 
     st.title("📚 Arabic Irab Analyzer")
     st.markdown(
@@ -252,9 +618,12 @@ def main():
 
     if analyze and input_text.strip():
         with st.spinner("جاري التحليل... | Analyzing..."):
-            result = run_full_analysis(input_text.strip())
+            result = run_full_analysis(input_text.strip(), model)
 
         if result["success"]:
+            # Imported here so pandas stays off the cold-start path until there are results
+            import pandas as pd
+
             st.success("✅ Analysis complete | اكتمل التحليل")
 
             tab1, tab2, tab3 = st.tabs([
@@ -265,24 +634,22 @@ def main():
 
             with tab1:
                 st.markdown("#### التحليل النحوي الكامل")
-                rows = []
-                for w in result["irab"]:
-                    rows.append({
-                        "الكلمة"     : w.get("word", ""),
-                        "الإعراب"    : w.get("irab", ""),
-                        "العلامة"    : w.get("sign", ""),
-                        "التفاصيل"   : w.get("details", ""),
-                        "Explanation": w.get("explanation", "")
-                    })
+                irab_df = (
+                    pd.DataFrame.from_records(result["irab"], columns=list(IRAB_COLUMNS))
+                    .fillna("")
+                    .rename(columns=IRAB_COLUMNS)
+                    # Roles and signs repeat a lot — categoricals serialize smaller
+                    .astype({"الإعراب": "category", "العلامة": "category"})
+                )
                 st.dataframe(
-                    pd.DataFrame(rows),
+                    irab_df,
                     use_container_width=True,
                     hide_index=True
                 )
                 st.markdown("---")
                 st.markdown("#### تفصيل كل كلمة")
-                for w in result["irab"]:
-                    st.markdown(word_card(w), unsafe_allow_html=True)
+                # One element for all cards — a single delta to the frontend per rerun
+                st.markdown("".join(word_card(w) for w in result["irab"]), unsafe_allow_html=True)
 
             with tab2:
                 st.markdown("#### PyArabic Preprocessing Features")
@@ -303,7 +670,14 @@ def main():
                 )
 
             with tab3:
-                st.json(result)
+                # Underscore keys (e.g. _color) are render hints, not analysis output
+                st.json({
+                    **result,
+                    "irab": [
+                        {k: v for k, v in w.items() if not k.startswith("_")}
+                        for w in result["irab"]
+                    ],
+                })
 
         else:
             st.error("❌ " + str(result["error"]))
@@ -314,7 +688,7 @@ def main():
     st.markdown("---")
     st.markdown(
         "<div style=\"text-align:center;color:#aaa;font-size:13px;\">"
-        "Built with PyArabic + Gemini 2.0 Flash · Powered by Streamlit"
+        "Built with PyArabic + Gemini · Powered by Streamlit"
         "</div>",
         unsafe_allow_html=True
     )